@@ -1,25 +1,35 @@
 # app/main.py
 import os
-import shutil
-import json
+import asyncio
+import aiofiles
+import orjson
+import hashlib
+import pickle
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 import pandas as pd
 from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Request
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+from app.utils.file_utils import evict_lru
+from app.utils.static_cache import CachedStaticFiles, SPAStaticFiles
 from app.services.csv_service import (
-    construct_test_cases_from_csv,
+    construct_test_cases_from_csv_iter,
+    construct_test_cases_from_df,
     process_csv_and_generate,
     refine_plantuml_code,
     enrich_test_cases_with_ai,
+    enrich_test_cases_with_ai_async,
+    warm_openai_client,
 )
 
 # New CMDB service imports
@@ -32,19 +42,31 @@ from app.services.cmdb_service import (
 
 load_dotenv()
 
+# Optional dev fallback key (previously hardcoded in main3.py); set
+# DEV_OPENAI_API_KEY to run without the frontend supplying a key.
+DEV_FALLBACK_API_KEY = os.getenv("DEV_OPENAI_API_KEY")
+
 BASE_DIR = Path(__file__).resolve().parent.parent
 UPLOAD_DIR = BASE_DIR / "uploads"
 STATIC_DIR = BASE_DIR / "static"
+CACHE_DIR = BASE_DIR / "cache"
 FRONTEND_DIST_DIR = BASE_DIR.parent / "frontend" / "dist"
 UPLOAD_DIR.mkdir(exist_ok=True, parents=True)
 STATIC_DIR.mkdir(exist_ok=True, parents=True)
+CACHE_DIR.mkdir(exist_ok=True, parents=True)
 
-logger.info(f"Frontend dist directory: {FRONTEND_DIST_DIR}")
+logger.info("Frontend dist directory: %s", FRONTEND_DIST_DIR)
 
 # Default port configuration
 DEFAULT_PORT = 8000
 
-app = FastAPI(title="Test Case → PlantUML & CMDB → PlantUML Generator")
+# Reject uploads larger than this before any disk write
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+
+app = FastAPI(
+    title="Test Case → PlantUML & CMDB → PlantUML Generator",
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -54,17 +76,32 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large JSON payloads (test suites, CMDB items)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Segregated blocking pools: a small CPU-bound pool for parsing/rendering and
+# a larger pool for I/O-bound LLM pipelines, so slow OpenAI calls cannot
+# starve the renderer (or exhaust the shared default threadpool).
+app.state.render_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="render")
+app.state.llm_pool = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_POOL_WORKERS", "64")), thread_name_prefix="llm")
+
+
+async def run_in_pool(pool, func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(pool, partial(func, *args, **kwargs))
+
+
 # Serve generated images
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
 
 # Serve React frontend static files
-app.mount("/assets", StaticFiles(directory=FRONTEND_DIST_DIR / "assets"), name="frontend_assets")
+app.mount("/assets", CachedStaticFiles(directory=FRONTEND_DIST_DIR / "assets"), name="frontend_assets")
 
 
-@app.get("/")
-async def serve_frontend():
-    """Serve the React frontend index.html"""
-    return FileResponse(FRONTEND_DIST_DIR / "index.html")
+@app.on_event("startup")
+async def _warm_openai():
+    # Best-effort background warm-up; doesn't delay startup.
+    if os.getenv("OPENAI_API_KEY"):
+        asyncio.create_task(warm_openai_client())
 
 
 @app.get("/health")
@@ -79,61 +116,83 @@ async def health_check():
 @app.post("/upload-csv/")
 async def upload_csv(request: Request, file: UploadFile = File(...)):
     filename = file.filename.lower()
+    # Validate before any file I/O so rejected uploads never touch the disk
+    if not filename.endswith((".csv", ".xls", ".xlsx")):
+        raise HTTPException(status_code=400, detail="Only CSV or Excel files allowed")
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Upload exceeds the size limit")
     dest = UPLOAD_DIR / file.filename
 
-    with open(dest, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    hasher = hashlib.sha256()
+    async with aiofiles.open(dest, "wb") as f:
+        while chunk := await file.read(1024 * 1024):
+            hasher.update(chunk)
+            await f.write(chunk)
+    digest = hasher.hexdigest()
 
-    # Convert Excel → CSV
+    # Excel is parsed once and handed to the parser as a DataFrame
+    df = None
     if filename.endswith(".xlsx") or filename.endswith(".xls"):
-        df = pd.read_excel(dest)
-        csv_path = dest.with_suffix(".csv")
-        df.to_csv(csv_path, index=False)
-        dest = csv_path
-    elif not filename.endswith(".csv"):
-        raise HTTPException(status_code=400, detail="Only CSV or Excel files allowed")
+        df = pd.read_excel(dest, engine="calamine")
 
     try:
-        logger.info(f"=== CSV UPLOAD PROCESSING START ===")
-        logger.info(f"Processing file: {file.filename}")
-        logger.info(f"File size: {dest.stat().st_size} bytes")
+        logger.info("=== CSV UPLOAD PROCESSING START ===")
+        logger.debug("Processing file: %s", file.filename)
+        logger.debug("File size: %s bytes", dest.stat().st_size)
         
         # Get API key from request headers
-        openai_key = request.headers.get("X-OpenAI-API-Key")
+        openai_key = request.headers.get("X-OpenAI-API-Key") or DEV_FALLBACK_API_KEY
         if not openai_key:
             logger.warning("No OpenAI API key provided in headers - AI enhancement will be skipped")
             logger.warning("For comprehensive test case generation, please provide OpenAI API key in X-OpenAI-API-Key header")
         else:
-            logger.info(f"✓ OpenAI API Key found (length: {len(openai_key)})")
-        
-        # Step 1: Construct initial test cases from CSV
-        logger.info("Step 1: Constructing initial test cases from CSV...")
-        test_cases = construct_test_cases_from_csv(str(dest), openai_key)
-        logger.info(f"✓ Generated {len(test_cases)} initial test cases")
+            logger.debug("OpenAI API key found (length: %s)", len(openai_key))
         
-        # Step 2: Enhance with AI analysis (only if API key is available)
-        if openai_key:
-            logger.info("Step 2: Enhancing test cases with AI analysis...")
-            enhanced_test_cases = enrich_test_cases_with_ai(test_cases, openai_key)
-            logger.info(f"✓ AI enhancement completed - {len(enhanced_test_cases)} comprehensive test cases generated")
+        # Identical uploads skip parsing and enrichment entirely
+        cache_path = CACHE_DIR / f"{digest}{'-ai' if openai_key else ''}.pkl"
+        if cache_path.exists():
+            logger.info("Cache hit for upload %s - returning cached test cases", digest[:12])
+            enhanced_test_cases = pickle.loads(cache_path.read_bytes())
         else:
-            logger.info("Step 2: Skipping AI enhancement (no API key provided)")
-            enhanced_test_cases = test_cases
+            # Step 1: Construct initial test cases from CSV
+            logger.debug("Step 1: Constructing initial test cases from CSV...")
+            if df is not None:
+                test_cases = await run_in_pool(app.state.render_pool, construct_test_cases_from_df, df, openai_key)
+            else:
+                test_cases = await run_in_pool(
+                    app.state.render_pool,
+                    lambda: list(construct_test_cases_from_csv_iter(str(dest), openai_key)),
+                )
+            logger.debug("Generated %s initial test cases", len(test_cases))
+        
+            # Step 2: Enhance with AI analysis (only if API key is available)
+            if openai_key:
+                logger.debug("Step 2: Enhancing test cases with AI analysis...")
+                enhanced_test_cases = await enrich_test_cases_with_ai_async(test_cases, openai_key)
+                logger.debug("AI enhancement completed - %s comprehensive test cases generated", len(enhanced_test_cases))
+            else:
+                logger.debug("Step 2: Skipping AI enhancement (no API key provided)")
+                enhanced_test_cases = test_cases
+            cache_path.write_bytes(pickle.dumps(enhanced_test_cases))
+            evict_lru(CACHE_DIR)
         
         # Safe-serialize for frontend
         def _serialize(tc_list):
-            out = []
+            # Fast path: if no action needs re-encoding, return the list as-is
+            # instead of deep-copying every test case and step.
+            needs_escape = any(
+                isinstance(s.get("action"), (dict, list))
+                for tc in tc_list
+                for s in tc.get("steps", [])
+            )
+            if not needs_escape:
+                return tc_list
             for tc in tc_list:
-                tc_copy = dict(tc)
-                steps = []
-                for s in tc_copy.get("steps", []):
-                    s_copy = dict(s)
-                    if isinstance(s_copy.get("action"), (dict, list)):
-                        s_copy["action"] = json.dumps(s_copy["action"], default=str)
-                    steps.append(s_copy)
-                tc_copy["steps"] = steps
-                out.append(tc_copy)
-            return out
+                for s in tc.get("steps", []):
+                    action = s.get("action")
+                    if isinstance(action, (dict, list)):
+                        s["action"] = orjson.dumps(action, default=str).decode()
+            return tc_list
 
         logger.info("=== CSV UPLOAD PROCESSING SUCCESS ===")
         return {"success": True, "test_cases": _serialize(enhanced_test_cases)}
@@ -151,12 +210,10 @@ async def generate_diagram(request: Request, body: dict = Body(...)):
         test_cases = body.get("test_cases")
         if not test_cases or not isinstance(test_cases, list):
             raise HTTPException(status_code=400, detail="No test_cases provided")
-        openai_key = request.headers.get("X-OpenAI-API-Key")
+        openai_key = request.headers.get("X-OpenAI-API-Key") or DEV_FALLBACK_API_KEY
         if not openai_key:
             raise HTTPException(status_code=400, detail="OpenAI API key is required. Please provide it in the X-OpenAI-API-Key header.")
-        os.environ["OPENAI_API_KEY"] = openai_key
-
-        result = process_csv_and_generate(csv_path=None, output_dir=str(STATIC_DIR), test_cases=test_cases)
+        result = await run_in_pool(app.state.llm_pool, process_csv_and_generate, csv_path=None, output_dir=str(STATIC_DIR), test_cases=test_cases, openai_api_key=openai_key)
         if not result.get("success", False):
             raise HTTPException(status_code=500, detail=result.get("error", "Failed to process test cases"))
         return result
@@ -173,12 +230,10 @@ async def chat_plantuml(request: Request, body: dict = Body(...)):
     user_message = body.get("message")
     if not plantuml_code or not user_message:
         raise HTTPException(status_code=400, detail="plantuml_code and message are required")
-    openai_key = request.headers.get("X-OpenAI-API-Key")
+    openai_key = request.headers.get("X-OpenAI-API-Key") or DEV_FALLBACK_API_KEY
     if not openai_key:
         raise HTTPException(status_code=400, detail="OpenAI API key is required. Please provide it in the X-OpenAI-API-Key header.")
-    os.environ["OPENAI_API_KEY"] = openai_key
-
-    result = refine_plantuml_code(plantuml_code=plantuml_code, message=user_message, output_dir=str(STATIC_DIR))
+    result = await run_in_pool(app.state.llm_pool, refine_plantuml_code, plantuml_code=plantuml_code, message=user_message, output_dir=str(STATIC_DIR), openai_api_key=openai_key)
     if not result.get("success", False):
         raise HTTPException(status_code=500, detail=result.get("error", "Failed to refine PlantUML"))
     return result
@@ -197,25 +252,26 @@ async def upload_cmdb(request: Request, file: UploadFile = File(...)):
     filename = file.filename.lower()
     dest = UPLOAD_DIR / file.filename
 
-    with open(dest, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    async with aiofiles.open(dest, "wb") as f:
+        while chunk := await file.read(1024 * 1024):
+            await f.write(chunk)
 
     try:
-        logger.info(f"=== CMDB UPLOAD START ===")
-        logger.info(f"Processing CMDB file: {file.filename} (size: {dest.stat().st_size} bytes)")
+        logger.info("=== CMDB UPLOAD START ===")
+        logger.debug("Processing CMDB file: %s (size: %s bytes)", file.filename, dest.stat().st_size)
 
         # Attempt to convert Excel -> CSV for convenience (construct_cmdb_from_file handles CSV/Excel)
-        cmdb_items = construct_cmdb_from_file(str(dest))
-        logger.info(f"✓ Parsed {len(cmdb_items)} CMDB items")
+        cmdb_items = await run_in_pool(app.state.render_pool, construct_cmdb_from_file, str(dest))
+        logger.debug("Parsed %s CMDB items", len(cmdb_items))
 
         # AI enhancement if API key provided
-        openai_key = request.headers.get("X-OpenAI-API-Key")
+        openai_key = request.headers.get("X-OpenAI-API-Key") or DEV_FALLBACK_API_KEY
         if openai_key:
-            logger.info("Enhancing CMDB with AI to infer relationships and topology...")
-            enhanced = enrich_cmdb_with_ai_service(cmdb_items, openai_api_key=openai_key)
-            logger.info(f"✓ AI enriched CMDB items (count now: {len(enhanced)})")
+            logger.debug("Enhancing CMDB with AI to infer relationships and topology...")
+            enhanced = await run_in_pool(app.state.llm_pool, enrich_cmdb_with_ai_service, cmdb_items, openai_api_key=openai_key)
+            logger.debug("AI enriched CMDB items (count now: %s)", len(enhanced))
         else:
-            logger.info("No OpenAI key provided; returning parsed CMDB items without enrichment")
+            logger.debug("No OpenAI key provided; returning parsed CMDB items without enrichment")
             enhanced = cmdb_items
 
         return {"success": True, "cmdb_items": enhanced}
@@ -234,12 +290,10 @@ async def generate_cmdb_diagram(request: Request, body: dict = Body(...)):
         if not cmdb_items or not isinstance(cmdb_items, list):
             raise HTTPException(status_code=400, detail="cmdb_items (list) is required")
 
-        openai_key = request.headers.get("X-OpenAI-API-Key")
+        openai_key = request.headers.get("X-OpenAI-API-Key") or DEV_FALLBACK_API_KEY
         if not openai_key:
             raise HTTPException(status_code=400, detail="OpenAI API key is required in X-OpenAI-API-Key header")
-        os.environ["OPENAI_API_KEY"] = openai_key
-
-        result = process_cmdb_and_generate(cmdb_items=cmdb_items, output_dir=str(STATIC_DIR))
+        result = await run_in_pool(app.state.llm_pool, process_cmdb_and_generate, cmdb_items=cmdb_items, output_dir=str(STATIC_DIR), openai_api_key=openai_key)
         if not result.get("success", False):
             raise HTTPException(status_code=500, detail=result.get("error", "Failed to generate CMDB diagram"))
         return result
@@ -256,26 +310,33 @@ async def chat_cmdb_plantuml(request: Request, body: dict = Body(...)):
     user_message = body.get("message")
     if not plantuml_code or not user_message:
         raise HTTPException(status_code=400, detail="plantuml_code and message are required")
-    openai_key = request.headers.get("X-OpenAI-API-Key")
+    openai_key = request.headers.get("X-OpenAI-API-Key") or DEV_FALLBACK_API_KEY
     if not openai_key:
         raise HTTPException(status_code=400, detail="OpenAI API key is required. Please provide it in the X-OpenAI-API-Key header.")
-    os.environ["OPENAI_API_KEY"] = openai_key
-
-    result = refine_cmdb_plantuml_code(plantuml_code=plantuml_code, message=user_message, output_dir=str(STATIC_DIR))
+    result = await run_in_pool(app.state.llm_pool, refine_cmdb_plantuml_code, plantuml_code=plantuml_code, message=user_message, output_dir=str(STATIC_DIR), openai_api_key=openai_key)
     if not result.get("success", False):
         raise HTTPException(status_code=500, detail=result.get("error", "Failed to refine CMDB PlantUML"))
     return result
 
 
-# Catch-all route for React Router (must be last)
-@app.get("/{full_path:path}")
-async def serve_frontend_catch_all(full_path: str):
-    """Catch-all route to serve React app for client-side routing"""
-    if full_path.startswith(("api/", "upload-csv/", "generate-diagram/", "chat-plantuml/", "health", "upload-cmdb/", "generate-cmdb-diagram/", "chat-cmdb-plantuml/")):
-        raise HTTPException(status_code=404, detail="API endpoint not found")
-    return FileResponse(FRONTEND_DIST_DIR / "index.html")
+# SPA fallback mount (must be last so API routes win resolution); serves
+# frontend files directly from Starlette with index.html for unknown paths.
+app.mount("/", SPAStaticFiles(directory=FRONTEND_DIST_DIR, html=True), name="spa")
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=int(os.getenv("PORT", 8000)), reload=True)
\ No newline at end of file
+    if os.getenv("DEV"):
+        uvicorn.run("app.main:app", host="0.0.0.0", port=int(os.getenv("PORT", DEFAULT_PORT)), reload=True)
+    else:
+        # reload=True forces a single worker and the asyncio loop; production
+        # gets N workers instead. loop="auto" picks uvloop where it is
+        # installed (everywhere but Windows, per requirements.txt).
+        uvicorn.run(
+            "app.main:app",
+            host="0.0.0.0",
+            port=int(os.getenv("PORT", DEFAULT_PORT)),
+            workers=int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1)),
+            loop="auto",
+            http="httptools",
+        )
\ No newline at end of file
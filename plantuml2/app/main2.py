@@ -1,20 +1,34 @@
 # app/main.py
 import os
-import shutil
-import json
+import logging
+import asyncio
+import aiofiles
+import orjson
+import hashlib
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from pathlib import Path
 import pandas as pd
 from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Request
-from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from dotenv import load_dotenv
 
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+from app.utils.file_utils import evict_lru
+from app.utils.static_cache import CachedStaticFiles, SPAStaticFiles
 from app.services.csv_service import (
-    construct_test_cases_from_csv,
+    construct_test_cases_from_csv_iter,
+    construct_test_cases_from_df,
     process_csv_and_generate,
     refine_plantuml_code,
     enrich_test_cases_with_ai,
+    enrich_test_cases_with_ai_async,
 )
 
 load_dotenv()
@@ -22,16 +36,24 @@ load_dotenv()
 BASE_DIR = Path(__file__).resolve().parent.parent
 UPLOAD_DIR = BASE_DIR / "uploads"
 STATIC_DIR = BASE_DIR / "static"
+CACHE_DIR = BASE_DIR / "cache"
 FRONTEND_DIST_DIR = BASE_DIR.parent / "frontend" / "dist"
 UPLOAD_DIR.mkdir(exist_ok=True, parents=True)
 STATIC_DIR.mkdir(exist_ok=True, parents=True)
+CACHE_DIR.mkdir(exist_ok=True, parents=True)
 
-print(FRONTEND_DIST_DIR, "FRONTEND_DIST_DIR");
+logger.info("Frontend dist directory: %s", FRONTEND_DIST_DIR)
 
 # Default port configuration
 DEFAULT_PORT = 8000
 
-app = FastAPI(title="Test Case → PlantUML Generator")
+# Reject uploads larger than this before any disk write
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+
+app = FastAPI(
+    title="Test Case → PlantUML Generator",
+    default_response_class=ORJSONResponse,
+)
 
 app.add_middleware(
     CORSMiddleware,
@@ -41,17 +63,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Serve generated images
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+# Compress large JSON payloads (test suites, CMDB items)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 
-# Serve React frontend static files
-app.mount("/assets", StaticFiles(directory=FRONTEND_DIST_DIR / "assets"), name="frontend_assets")
+# Segregated blocking pools: a small CPU-bound pool for parsing/rendering and
+# a larger pool for I/O-bound LLM pipelines, so slow OpenAI calls cannot
+# starve the renderer (or exhaust the shared default threadpool).
+app.state.render_pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 2, thread_name_prefix="render")
+app.state.llm_pool = ThreadPoolExecutor(max_workers=int(os.getenv("LLM_POOL_WORKERS", "64")), thread_name_prefix="llm")
 
 
-@app.get("/")
-async def serve_frontend():
-    """Serve the React frontend index.html"""
-    return FileResponse(FRONTEND_DIST_DIR / "index.html")
+async def run_in_pool(pool, func, *args, **kwargs):
+    return await asyncio.get_running_loop().run_in_executor(pool, partial(func, *args, **kwargs))
+
+
+# Serve generated images
+app.mount("/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
+
+# Serve React frontend static files
+app.mount("/assets", CachedStaticFiles(directory=FRONTEND_DIST_DIR / "assets"), name="frontend_assets")
 
 
 @app.get("/health")
@@ -101,51 +131,70 @@ async def upload_csv(request: Request, file: UploadFile = File(...)):
     for frontend editing. No PlantUML is generated yet.
     """
     filename = file.filename.lower()
+    # Validate before any file I/O so rejected uploads never touch the disk
+    if not filename.endswith((".csv", ".xls", ".xlsx")):
+        raise HTTPException(status_code=400, detail="Only CSV or Excel files allowed")
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail="Upload exceeds the size limit")
     dest = UPLOAD_DIR / file.filename
 
-    with open(dest, "wb") as f:
-        shutil.copyfileobj(file.file, f)
+    hasher = hashlib.sha256()
+    async with aiofiles.open(dest, "wb") as f:
+        while chunk := await file.read(1024 * 1024):
+            hasher.update(chunk)
+            await f.write(chunk)
+    digest = hasher.hexdigest()
 
-    # Convert Excel → CSV
+    # Excel is parsed once and handed to the parser as a DataFrame
+    df = None
     if filename.endswith(".xlsx") or filename.endswith(".xls"):
-        df = pd.read_excel(dest)
-        csv_path = dest.with_suffix(".csv")
-        df.to_csv(csv_path, index=False)
-        dest = csv_path
-    elif not filename.endswith(".csv"):
-        raise HTTPException(status_code=400, detail="Only CSV or Excel files allowed")
+        df = pd.read_excel(dest, engine="calamine")
 
     try:
-        print(f"=== CSV UPLOAD PROCESSING START ===")
-        print(f"Processing file: {file.filename}")
-        print(f"File size: {dest.stat().st_size} bytes")
+        logger.info("=== CSV UPLOAD PROCESSING START ===")
+        logger.debug("Processing file: %s", file.filename)
+        logger.debug("File size: %s bytes", dest.stat().st_size)
         
         # Get API key from request headers
         openai_key = request.headers.get("X-OpenAI-API-Key")
         if not openai_key:
-            print("WARNING: No OpenAI API key provided in headers - AI enhancement will be skipped")
-            print("For comprehensive test case generation, please provide OpenAI API key in X-OpenAI-API-Key header")
+            logger.warning("No OpenAI API key provided in headers - AI enhancement will be skipped")
+            logger.debug("For comprehensive test case generation, please provide OpenAI API key in X-OpenAI-API-Key header")
         else:
-            print(f"✓ OpenAI API Key found (length: {len(openai_key)})")
-        
-        # Step 1: Construct initial test cases from CSV
-        print("Step 1: Constructing initial test cases from CSV...")
-        test_cases = construct_test_cases_from_csv(str(dest), openai_key)
-        print(f"✓ Generated {len(test_cases)} initial test cases")
+            logger.debug("✓ OpenAI API Key found (length: %s)", len(openai_key))
         
-        # Step 2: Enhance with AI analysis (only if API key is available)
-        if openai_key:
-            print("Step 2: Enhancing test cases with AI analysis...")
-            print("This may take a moment as AI analyzes the data and generates comprehensive test coverage...")
-            enhanced_test_cases = enrich_test_cases_with_ai(test_cases, openai_key)
-            print(f"✓ AI enhancement completed - {len(enhanced_test_cases)} comprehensive test cases generated")
+        # Identical uploads skip parsing and enrichment entirely
+        cache_path = CACHE_DIR / f"{digest}{'-ai' if openai_key else ''}.pkl"
+        if cache_path.exists():
+            logger.debug("Cache hit for upload %.12s - returning cached test cases", digest)
+            enhanced_test_cases = pickle.loads(cache_path.read_bytes())
         else:
-            print("Step 2: Skipping AI enhancement (no API key provided)")
-            enhanced_test_cases = test_cases
+            # Step 1: Construct initial test cases from CSV
+            logger.debug("Step 1: Constructing initial test cases from CSV...")
+            if df is not None:
+                test_cases = await run_in_pool(app.state.render_pool, construct_test_cases_from_df, df, openai_key)
+            else:
+                test_cases = await run_in_pool(
+                    app.state.render_pool,
+                    lambda: list(construct_test_cases_from_csv_iter(str(dest), openai_key)),
+                )
+            logger.debug("✓ Generated %s initial test cases", len(test_cases))
         
-        # Log some statistics about the enhancement
-        if len(enhanced_test_cases) > len(test_cases):
-            print(f"✓ AI added {len(enhanced_test_cases) - len(test_cases)} additional test cases for comprehensive coverage")
+            # Step 2: Enhance with AI analysis (only if API key is available)
+            if openai_key:
+                logger.debug("Step 2: Enhancing test cases with AI analysis...")
+                logger.debug("This may take a moment as AI analyzes the data and generates comprehensive test coverage...")
+                enhanced_test_cases = await enrich_test_cases_with_ai_async(test_cases, openai_key)
+                logger.debug("✓ AI enhancement completed - %s comprehensive test cases generated", len(enhanced_test_cases))
+            else:
+                logger.debug("Step 2: Skipping AI enhancement (no API key provided)")
+                enhanced_test_cases = test_cases
+        
+            # Log some statistics about the enhancement
+            if len(enhanced_test_cases) > len(test_cases):
+                logger.debug("✓ AI added %s additional test cases for comprehensive coverage", len(enhanced_test_cases) - len(test_cases))
+            cache_path.write_bytes(pickle.dumps(enhanced_test_cases))
+            evict_lru(CACHE_DIR)
         
         # Count actors and steps
         total_actors = set()
@@ -154,27 +203,30 @@ async def upload_csv(request: Request, file: UploadFile = File(...)):
             total_actors.update(tc.get("actors", []))
             total_steps += len(tc.get("steps", []))
         
-        print(f"✓ Final test suite contains:")
-        print(f"  - {len(enhanced_test_cases)} test cases")
-        print(f"  - {len(total_actors)} unique actors")
-        print(f"  - {total_steps} total test steps")
+        logger.debug("✓ Final test suite contains:")
+        logger.debug("  - %s test cases", len(enhanced_test_cases))
+        logger.debug("  - %s unique actors", len(total_actors))
+        logger.debug("  - %s total test steps", total_steps)
         
         # Serialize safely for frontend
         def _serialize(tc_list):
-            out = []
+            # Fast path: if no action needs re-encoding, return the list as-is
+            # instead of deep-copying every test case and step.
+            needs_escape = any(
+                isinstance(s.get("action"), (dict, list))
+                for tc in tc_list
+                for s in tc.get("steps", [])
+            )
+            if not needs_escape:
+                return tc_list
             for tc in tc_list:
-                tc_copy = dict(tc)
-                steps = []
-                for s in tc_copy.get("steps", []):
-                    s_copy = dict(s)
-                    if isinstance(s_copy.get("action"), (dict, list)):
-                        s_copy["action"] = json.dumps(s_copy["action"], default=str)
-                    steps.append(s_copy)
-                tc_copy["steps"] = steps
-                out.append(tc_copy)
-            return out
-
-        print("=== CSV UPLOAD PROCESSING SUCCESS ===")
+                for s in tc.get("steps", []):
+                    action = s.get("action")
+                    if isinstance(action, (dict, list)):
+                        s["action"] = orjson.dumps(action, default=str).decode()
+            return tc_list
+
+        logger.info("=== CSV UPLOAD PROCESSING SUCCESS ===")
         return {"success": True, "test_cases": _serialize(enhanced_test_cases)}
 
     except Exception as e:
@@ -189,58 +241,57 @@ async def generate_diagram(request: Request, body: dict = Body(...)):
     Accept edited test_cases JSON from frontend and resume PlantUML pipeline.
     """
     try:
-        print("=== GENERATE DIAGRAM START ===")
-        print(f"Request received at: {__import__('datetime').datetime.now()}")
+        logger.info("=== GENERATE DIAGRAM START ===")
+        logger.debug("Request received at: %s", __import__('datetime').datetime.now())
         
         test_cases = body.get("test_cases")
-        print(f"Test cases count: {len(test_cases) if test_cases else 0}")
+        logger.debug("Test cases count: %s", len(test_cases) if test_cases else 0)
         
         if not test_cases or not isinstance(test_cases, list):
-            print("ERROR: No test_cases provided or invalid format")
+            logger.warning("No test_cases provided or invalid format")
             raise HTTPException(status_code=400, detail="No test_cases provided")
 
-        print(f"Processing {len(test_cases)} test cases...")
-        print(f"Output directory: {STATIC_DIR}")
+        logger.debug("Processing %s test cases...", len(test_cases))
+        logger.debug("Output directory: %s", STATIC_DIR)
         
         # Get API key from request headers
         openai_key = request.headers.get("X-OpenAI-API-Key")
         if not openai_key:
-            print("ERROR: No OpenAI API key provided in headers")
+            logger.warning("No OpenAI API key provided in headers")
             raise HTTPException(status_code=400, detail="OpenAI API key is required. Please provide it in the X-OpenAI-API-Key header.")
         
-        print(f"OpenAI API Key present: {bool(openai_key)}")
-        print(f"OpenAI API Key length: {len(openai_key)}")
-        
-        # Set the API key as environment variable for the service
-        import os
-        os.environ["OPENAI_API_KEY"] = openai_key
+        logger.debug("OpenAI API Key present: %s", bool(openai_key))
+        logger.debug("OpenAI API Key length: %s", len(openai_key))
         
-        result = process_csv_and_generate(
-            csv_path=None, output_dir=str(STATIC_DIR), test_cases=test_cases
+        result = await run_in_pool(
+            app.state.llm_pool,
+            process_csv_and_generate,
+            csv_path=None, output_dir=str(STATIC_DIR), test_cases=test_cases,
+            openai_api_key=openai_key,
         )
 
-        print(f"Process result success: {result.get('success', False)}")
+        logger.debug("Process result success: %s", result.get('success', False))
         if not result.get("success", False):
             error_msg = result.get("error", "Failed to process test cases")
-            print(f"ERROR in process_csv_and_generate: {error_msg}")
-            print("=== GENERATE DIAGRAM ERROR ===")
+            logger.error("process_csv_and_generate failed: %s", error_msg)
+            logger.info("=== GENERATE DIAGRAM ERROR ===")
             raise HTTPException(
                 status_code=500,
                 detail=error_msg,
             )
 
-        print("Diagram generated successfully")
-        print("=== GENERATE DIAGRAM SUCCESS ===")
+        logger.debug("Diagram generated successfully")
+        logger.info("=== GENERATE DIAGRAM SUCCESS ===")
         return result
     except HTTPException:
         # Re-raise HTTP exceptions as-is
         raise
     except Exception as e:
-        print(f"UNEXPECTED ERROR in generate_diagram: {str(e)}")
-        print(f"Error type: {type(e).__name__}")
+        logger.error("Unexpected error in generate_diagram: %s", str(e))
+        logger.debug("Error type: %s", type(e).__name__)
         import traceback
         traceback.print_exc()
-        print("=== GENERATE DIAGRAM UNEXPECTED ERROR ===")
+        logger.info("=== GENERATE DIAGRAM UNEXPECTED ERROR ===")
         raise HTTPException(
             status_code=500,
             detail=f"Internal server error: {str(e)}",
@@ -261,12 +312,11 @@ async def chat_plantuml(request: Request, body: dict = Body(...)):
     if not openai_key:
         raise HTTPException(status_code=400, detail="OpenAI API key is required. Please provide it in the X-OpenAI-API-Key header.")
     
-    # Set the API key as environment variable for the service
-    import os
-    os.environ["OPENAI_API_KEY"] = openai_key
-
-    result = refine_plantuml_code(
-        plantuml_code=plantuml_code, message=user_message, output_dir=str(STATIC_DIR)
+    result = await run_in_pool(
+        app.state.llm_pool,
+        refine_plantuml_code,
+        plantuml_code=plantuml_code, message=user_message, output_dir=str(STATIC_DIR),
+        openai_api_key=openai_key,
     )
 
     if not result.get("success", False):
@@ -278,18 +328,21 @@ async def chat_plantuml(request: Request, body: dict = Body(...)):
     return result
 
 
-# Catch-all route for React Router (must be last)
-@app.get("/{full_path:path}")
-async def serve_frontend_catch_all(full_path: str):
-    """Catch-all route to serve React app for client-side routing"""
-    # Check if the path is an API route
-    if full_path.startswith(("api/", "upload-csv/", "generate-diagram/", "chat-plantuml/", "health")):
-        raise HTTPException(status_code=404, detail="API endpoint not found")
-    
-    # For all other routes, serve the React app
-    return FileResponse(FRONTEND_DIST_DIR / "index.html")
+# SPA fallback mount (must be last so API routes win resolution); serves
+# frontend files directly from Starlette with index.html for unknown paths.
+app.mount("/", SPAStaticFiles(directory=FRONTEND_DIST_DIR, html=True), name="spa")
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=DEFAULT_PORT, reload=True)
+    if os.getenv("DEV"):
+        uvicorn.run("app.main2:app", host="0.0.0.0", port=DEFAULT_PORT, reload=True)
+    else:
+        uvicorn.run(
+            "app.main2:app",
+            host="0.0.0.0",
+            port=DEFAULT_PORT,
+            workers=int(os.getenv("WEB_CONCURRENCY", (os.cpu_count() or 1) * 2 + 1)),
+            loop="auto",
+            http="httptools",
+        )
@@ -1,120 +1,275 @@
 # app/services/cmdb_service.py
 import re
 import json
+import asyncio
+import hashlib
 import tempfile
+import threading
 import os
 import csv
+from functools import lru_cache
 from pathlib import Path
-import pandas as pd
-
-from phi.agent import Agent
-from phi.model.openai import OpenAIChat
-from phi.tools.csv_tools import CsvTools
 
 from .plantuml_service import render_plantuml_from_text, PlantUMLSyntaxError
 
 
+@lru_cache(maxsize=None)
+def _phi():
+    """
+    Import the phi stack on first AI call. Parsing CMDB files never needs
+    it, and deferring the import keeps module import (and app cold start)
+    cheap; lru_cache makes every later call a dict hit.
+    """
+    from phi.agent import Agent
+    from phi.model.openai import OpenAIChat
+    from phi.tools.csv_tools import CsvTools
+    return Agent, OpenAIChat, CsvTools
+
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    _loads = orjson.loads
+
+    def _dumps(obj, indent: bool = False) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+else:
+    _loads = json.loads
+
+    def _dumps(obj, indent: bool = False) -> str:
+        return json.dumps(obj, ensure_ascii=False, indent=2 if indent else None,
+                          separators=None if indent else (",", ":"))
+
+# Enriched CMDB responses keyed by content hash; survives restarts and
+# spares a full LLM round-trip when the same data is re-uploaded.
+_ENRICH_CACHE_DIR = Path(tempfile.gettempdir()) / "cmdb_enrich_cache"
+
+# CMDBs above this size are enriched in concurrent per-chunk requests;
+# one giant prompt is latency-bound and risks the context limit.
+_ENRICH_CHUNK_SIZE = 50
+
+# Fixed-instruction agents reused across calls; keyed by (name, api key)
+# so multi-tenant requests never share credentials. The generator agent
+# is excluded: its CsvTools binding changes per request.
+_AGENT_CACHE = {}
+_AGENT_LOCK = threading.Lock()
+
+
+def _get_cached_model(openai_api_key: str = None):
+    """One OpenAIChat (and its HTTP connection pool) per api key."""
+    model = _AGENT_CACHE.get(openai_api_key)
+    if model is None:
+        with _AGENT_LOCK:
+            model = _AGENT_CACHE.get(openai_api_key)
+            if model is None:
+                _, OpenAIChat, _ = _phi()
+                model = OpenAIChat(id="gpt-5", api_key=openai_api_key)
+                _AGENT_CACHE[openai_api_key] = model
+    return model
+
+
+def _get_cached_agent(name: str, instructions: str, openai_api_key: str = None):
+    # Agents hold per-run state (run_response, memory) and must not be
+    # shared across threads; only the model client is cached.
+    Agent, _, _ = _phi()
+    return Agent(
+        name=name,
+        model=_get_cached_model(openai_api_key),
+        instructions=instructions,
+        markdown=True,
+    )
+
+# Key classes for _normalize_cmdb_item; frozensets give O(1) membership.
+_RELATION_KEYS = frozenset({"depends_on", "depends", "relations", "relation", "links", "connected_to"})
+_CORE_KEYS = frozenset({"id", "name", "type", "role"})
+
+# Compiled once at import; these run on every AI response parse.
+_CODE_BLOCK_GENERIC = re.compile(r"```(?:\w+)?\s*([\s\S]*?)```")
+_CODE_BLOCK_LANG_CACHE = {}
+
+# Single alternation covering every component declaration form, so one
+# pass over the PlantUML text replaces a findall per keyword.
+_COMPONENT_RE = re.compile(
+    r'(?:rectangle|component|database|cloud|node|queue|package)\s+(?:"([^"]+)"|(\w+))'
+    r'|\[([^\]]+)\]'   # [Component]
+    r'|\(([^)]+)\)',   # (Component)
+    re.IGNORECASE,
+)
+
+# Envelope check used to fail obviously broken AI output in microseconds
+# instead of a JVM round-trip.
+_STRUCTURE_RE = re.compile(r'^@startuml\b[\s\S]*^@enduml\s*$', re.MULTILINE)
+
+# Arrow lines ([A] --> [B] : label, "A" -left-> B, A ->> B ...) matched in
+# one buffer scan instead of per-line substring probes and splits.
+_RELATION_RE = re.compile(
+    r'^\s*(?:\[([^\]]+)\]|"([^"]+)"|([\w.-]+))\s*'
+    r'(?:-(?:left|right|up|down))?-+>{1,2}\s*'
+    r'(?:\[([^\]]+)\]|"([^"]+)"|([\w.-]+))\s*'
+    r'(?::\s*(.*\S))?\s*$',
+    re.MULTILINE,
+)
+
+
+_ENHANCER_INSTRUCTIONS = """You are an enterprise architect. Perform end-to-end enrichment of the provided CMDB data, considering both technical and business perspectives.
+    Enrich CMDB data with:
+    -Layer: edge, application, database, infrastructure, network, integration
+    -LOB: STME, Merchandising, Digital, Logics/Hub, Reporting/Analytics, Marketing, Corporate, Third-Party
+    -Criticality: high, medium, low
+    -Inferred relationships with types and reasons
+    -Business context and SPoF identification
+    Ensure consistency across all components and inferred relationships.
+    PRESERVE original IDs. Return ONLY JSON array."""
+
+_VALIDATOR_INSTRUCTIONS = """You are a PlantUML expert. Fix ANY syntax errors in PlantUML code.
+CRITICAL RULES:
+1. MUST start with @startuml and end with @enduml
+2. Use valid PlantUML components: package, rectangle, component, database, cloud, node, queue
+3. Use valid arrows: ->, -->, ->>, -->>
+4. Properly quote names with spaces: "Component Name"
+5. Fix all syntax errors while preserving the diagram intent
+Return ONLY the fixed PlantUML code in ```plantuml``` block."""
+
+_REFINER_INSTRUCTIONS = """Refine PlantUML diagrams based on user requests.
+PRESERVE the original architecture and relationships.
+ENHANCE based on user feedback.
+ALWAYS return valid PlantUML syntax.
+Return ONLY ```plantuml``` code block."""
+
+
+def _quick_validate(plantuml_code: str):
+    """
+    Cheap structural checks run before handing code to the renderer.
+    Returns a problem description, or None if the code looks plausible.
+    """
+    if not _STRUCTURE_RE.search(plantuml_code.strip()):
+        return "missing @startuml/@enduml envelope"
+    if plantuml_code.count('"') % 2:
+        return "unbalanced quotes"
+    return None
+
+
+_ZERO_WIDTH_RE = re.compile("[\u200b\u200c\u200d\ufeff]")
+
+
+def _local_fix_plantuml(code: str) -> str:
+    """
+    Deterministic repairs for the most common LLM mistakes (stray fences,
+    missing envelope, zero-width characters). Costs microseconds, so the
+    retry loops try this before paying for a fixer-agent round-trip.
+    """
+    fixed = _ZERO_WIDTH_RE.sub("", code)
+    fixed = fixed.replace("```plantuml", "").replace("```", "").strip()
+    if not fixed.startswith("@startuml"):
+        fixed = "@startuml\n" + fixed
+    if not fixed.rstrip().endswith("@enduml"):
+        fixed = fixed.rstrip() + "\n@enduml"
+    return fixed
+
+
 def _extract_code_block(text: str, lang_hint: str = None) -> str:
     """Extract code from markdown code blocks"""
     if lang_hint:
-        pattern = rf"```{lang_hint}\s*([\s\S]*?)```"
-        m = re.search(pattern, text, re.IGNORECASE)
+        pattern = _CODE_BLOCK_LANG_CACHE.setdefault(
+            lang_hint, re.compile(rf"```{lang_hint}\s*([\s\S]*?)```", re.IGNORECASE))
+        m = pattern.search(text)
         if m:
             return m.group(1).strip()
-    m = re.search(r"```(?:\w+)?\s*([\s\S]*?)```", text)
+    m = _CODE_BLOCK_GENERIC.search(text)
     return m.group(1).strip() if m else text.strip()
 
 
+def _parse_excel(path: Path) -> list:
+    import pandas as pd  # deferred: structured text inputs skip pandas
+    return _items_from_dataframe(pd.read_excel(path, engine='calamine'))
+
+
+def _parse_csv(path: Path) -> list:
+    # Pure-string workload: the stdlib csv reader matches pandas on
+    # throughput here without paying the pandas import or a DataFrame.
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.DictReader(f)
+        fieldnames = reader.fieldnames or []
+        rows = list(reader)
+    return _items_from_rows(fieldnames, rows)
+
+
+def _structured_items(data) -> list:
+    if isinstance(data, dict):
+        items = data.get("components") or data.get("resources") or [data]
+    elif isinstance(data, list):
+        items = data
+    else:
+        items = [data]
+    return [_normalize_cmdb_item(it) for it in items]
+
+
+def _parse_structured(path: Path) -> list:
+    """JSON files; free text falls back to a one-cell frame."""
+    raw = path.read_bytes()
+    # Only attempt JSON when the first byte can start a document, so
+    # free text skips a full tokenize-and-fail pass.
+    if raw.lstrip()[:1] in (b"{", b"["):
+        try:
+            return _structured_items(_loads(raw))
+        except Exception:
+            pass
+    import pandas as pd
+    return _items_from_dataframe(pd.DataFrame({"text": [raw.decode("utf-8")]}))
+
+
+def _parse_yaml(path: Path) -> list:
+    """YAML CMDB exports, parsed with the libyaml C loader when available."""
+    import yaml
+    try:
+        from yaml import CSafeLoader as _Loader
+    except ImportError:
+        from yaml import SafeLoader as _Loader
+    return _structured_items(yaml.load(path.read_bytes(), Loader=_Loader))
+
+
+def _parse_unknown(path: Path) -> list:
+    raw = path.read_bytes()
+    if raw.lstrip()[:1] in (b"{", b"["):
+        try:
+            data = _loads(raw)
+        except Exception:
+            data = None
+        if isinstance(data, list):
+            return [_normalize_cmdb_item(it) for it in data]
+        if isinstance(data, dict):
+            items = data.get("components") or [data]
+            return [_normalize_cmdb_item(it) for it in items]
+    return [{
+        "id": "CMDB_TEXT_1",
+        "name": "Imported CMDB Text",
+        "type": "unstructured",
+        "attributes": {"raw": raw.decode("utf-8")},
+        "relations": []
+    }]
+
+
+_PARSERS = {
+    ".xlsx": _parse_excel,
+    ".xls": _parse_excel,
+    ".csv": _parse_csv,
+    ".json": _parse_structured,
+    ".yaml": _parse_yaml,
+    ".yml": _parse_yaml,
+}
+
+
 def construct_cmdb_from_file(file_path: str) -> list:
     """
     Parse a CMDB file and return structured items.
     Accepts CSV, Excel, JSON, YAML, or single-cell free-text JSON/YAML.
     """
     path = Path(file_path)
-    suffix = path.suffix.lower()
-    
     try:
-        if suffix in (".xlsx", ".xls"):
-            df = pd.read_excel(path, engine='openpyxl')
-            tmp = path.with_suffix(".csv")
-            df.to_csv(tmp, index=False)
-            df = pd.read_csv(tmp)
-        elif suffix == ".csv":
-            df = pd.read_csv(path)
-        elif suffix in (".json", ".yaml", ".yml"):
-            text = path.read_text(encoding="utf-8")
-            try:
-                data = json.loads(text)
-                if isinstance(data, dict):
-                    items = data.get("components") or data.get("resources") or [data]
-                elif isinstance(data, list):
-                    items = data
-                else:
-                    items = [data]
-                return [_normalize_cmdb_item(it) for it in items]
-            except Exception:
-                df = pd.DataFrame({"text": [text]})
-        else:
-            text = path.read_text(encoding="utf-8")
-            try:
-                data = json.loads(text)
-                if isinstance(data, list):
-                    return [_normalize_cmdb_item(it) for it in data]
-                elif isinstance(data, dict):
-                    items = data.get("components") or [data]
-                    return [_normalize_cmdb_item(it) for it in items]
-            except Exception:
-                return [{
-                    "id": "CMDB_TEXT_1",
-                    "name": "Imported CMDB Text",
-                    "type": "unstructured",
-                    "attributes": {"raw": text},
-                    "relations": []
-                }]
-
-        if isinstance(df, pd.DataFrame):
-            df = df.fillna("")
-            lower_cols = {c.lower(): c for c in df.columns}
-            id_col = lower_cols.get("id") or lower_cols.get("name") or lower_cols.get("component") or None
-            type_col = lower_cols.get("type") or lower_cols.get("role")
-            relation_col = lower_cols.get("depends_on") or lower_cols.get("depends") or lower_cols.get("relationship")
-            
-            items = []
-            if id_col:
-                for _, row in df.iterrows():
-                    item = {
-                        "id": str(row[id_col]),
-                        "name": str(row[id_col]),
-                        "type": str(row[type_col]) if type_col else "component",
-                        "attributes": {},
-                        "relations": []
-                    }
-                    for c in df.columns:
-                        if c not in (id_col, type_col, relation_col):
-                            val = row[c]
-                            if pd.notna(val) and str(val).strip():
-                                item["attributes"][c] = val
-                    if relation_col and pd.notna(row[relation_col]) and str(row[relation_col]).strip():
-                        relations = [r.strip() for r in str(row[relation_col]).split(",") if r.strip()]
-                        for rel in relations:
-                            item["relations"].append({"target": rel, "type": "depends_on"})
-                    items.append(item)
-            else:
-                for idx, row in df.iterrows():
-                    item = {
-                        "id": f"CMDB_ROW_{idx+1}",
-                        "name": f"Row {idx+1}",
-                        "type": "component",
-                        "attributes": {},
-                        "relations": []
-                    }
-                    for c in df.columns:
-                        val = row[c]
-                        if pd.notna(val) and str(val).strip():
-                            item["attributes"][c] = val
-                    items.append(item)
-            return items
-
+        return _PARSERS.get(path.suffix.lower(), _parse_unknown)(path)
     except Exception as e:
         return [{
             "id": "CMDB_PARSE_ERROR",
@@ -125,6 +280,95 @@ def construct_cmdb_from_file(file_path: str) -> list:
         }]
 
 
+def _items_from_rows(fieldnames: list, rows: list) -> list:
+    """Convert csv.DictReader rows into the normalized item shape."""
+    lower_cols = {c.lower(): c for c in fieldnames}
+    id_col = lower_cols.get("id") or lower_cols.get("name") or lower_cols.get("component") or None
+    type_col = lower_cols.get("type") or lower_cols.get("role")
+    relation_col = lower_cols.get("depends_on") or lower_cols.get("depends") or lower_cols.get("relationship")
+
+    if id_col:
+        attr_cols = [c for c in fieldnames if c not in (id_col, type_col, relation_col)]
+        return [
+            {
+                "id": str(row.get(id_col) or ""),
+                "name": str(row.get(id_col) or ""),
+                "type": str(row.get(type_col) or "") if type_col else "component",
+                "attributes": {c: row[c] for c in attr_cols
+                               if row.get(c) and str(row[c]).strip()},
+                "relations": [{"target": t.strip(), "type": "depends_on"}
+                              for t in str(row.get(relation_col) or "").split(",")
+                              if t.strip()] if relation_col else [],
+            }
+            for row in rows
+        ]
+    return [
+        {
+            "id": f"CMDB_ROW_{i+1}",
+            "name": f"Row {i+1}",
+            "type": "component",
+            "attributes": {c: v for c, v in row.items() if v and str(v).strip()},
+            "relations": []
+        }
+        for i, row in enumerate(rows)
+    ]
+
+
+def _items_from_dataframe(df) -> list:
+    """Convert a tabular CMDB frame into the normalized item shape."""
+    df = df.fillna("")
+    lower_cols = {c.lower(): c for c in df.columns}
+    id_col = lower_cols.get("id") or lower_cols.get("name") or lower_cols.get("component") or None
+    type_col = lower_cols.get("type") or lower_cols.get("role")
+    relation_col = lower_cols.get("depends_on") or lower_cols.get("depends") or lower_cols.get("relationship")
+
+    if id_col:
+        attr_cols = [c for c in df.columns if c not in (id_col, type_col, relation_col)]
+        ids = df[id_col].astype(str).tolist()
+        types = df[type_col].astype(str).tolist() if type_col else None
+        if relation_col:
+            relations_per_row = [
+                [{"target": t.strip(), "type": "depends_on"}
+                 for t in str(raw).split(",") if t.strip()]
+                for raw in df[relation_col].tolist()
+            ]
+        else:
+            relations_per_row = None
+        # df[[]].to_dict("records") is [] even with rows, so an id-plus-
+        # relations-only sheet needs explicit empty attribute dicts.
+        attr_records = _nonblank_records(df[attr_cols]) if attr_cols else [{}] * len(df)
+        return [
+            {
+                "id": ids[i],
+                "name": ids[i],
+                "type": types[i] if types is not None else "component",
+                "attributes": attr_records[i],
+                "relations": relations_per_row[i] if relations_per_row is not None else [],
+            }
+            for i in range(len(ids))
+        ]
+    return [
+        {
+            "id": f"CMDB_ROW_{i+1}",
+            "name": f"Row {i+1}",
+            "type": "component",
+            "attributes": attrs,
+            "relations": []
+        }
+        for i, attrs in enumerate(_nonblank_records(df))
+    ]
+
+
+def _nonblank_records(frame) -> list:
+    """Row dicts with blank cells dropped; the blank test runs column-wise."""
+    keep = frame.astype(str).apply(lambda s: s.str.strip() != "")
+    return [
+        {c: v for c, v in rec.items() if krec[c]}
+        for rec, krec in zip(frame.to_dict(orient="records"),
+                             keep.to_dict(orient="records"))
+    ]
+
+
 def _normalize_cmdb_item(raw: dict) -> dict:
     """Normalize arbitrary dict into CMDB item shape."""
     item = {}
@@ -135,7 +379,8 @@ def _normalize_cmdb_item(raw: dict) -> dict:
     attributes = {}
     relations = []
     for k, v in raw.items():
-        if k.lower() in ("depends_on", "depends", "relations", "relation", "links", "connected_to"):
+        lk = k.lower()
+        if lk in _RELATION_KEYS:
             if isinstance(v, list):
                 for t in v:
                     relations.append({"target": t, "type": "depends_on"})
@@ -143,59 +388,82 @@ def _normalize_cmdb_item(raw: dict) -> dict:
                 for t in v.split(","):
                     if t.strip():
                         relations.append({"target": t.strip(), "type": "depends_on"})
-        elif k.lower() not in ("id", "name", "type", "role"):
+        elif lk not in _CORE_KEYS:
             attributes[k] = v
     item["attributes"] = attributes
     item["relations"] = relations
     return item
 
 
-def enrich_cmdb_with_ai(cmdb_items: list, openai_api_key: str = None) -> list:
-    """
-    Use AI to infer missing relations, group into layers, detect SPoF.
-    """
-    if openai_api_key:
-        os.environ["OPENAI_API_KEY"] = openai_api_key
-
-    agent = Agent(
-        name="CMDB Enhancer",
-        model=OpenAIChat(id="gpt-5"),
-        instructions="""You are an enterprise architect. Perform end-to-end enrichment of the provided CMDB data, considering both technical and business perspectives.
-    Enrich CMDB data with:
-    -Layer: edge, application, database, infrastructure, network, integration
-    -LOB: STME, Merchandising, Digital, Logics/Hub, Reporting/Analytics, Marketing, Corporate, Third-Party
-    -Criticality: high, medium, low
-    -Inferred relationships with types and reasons
-    -Business context and SPoF identification
-    Ensure consistency across all components and inferred relationships.
-    PRESERVE original IDs. Return ONLY JSON array.""",
-        markdown=True,
-    )
-
-    prompt = f"""
-    Analyze these {len(cmdb_items)} CMDB items and provide comprehensive enrichment:
+def _enrich_prompt(items: list) -> str:
+    return f"""
+    Analyze these {len(items)} CMDB items and provide comprehensive enrichment:
     
     ORIGINAL ITEMS:
-    {json.dumps(cmdb_items, indent=2)}
+    {_dumps(items)}
     
     Return enhanced JSON array with all original items plus inferred relationships and attributes.
     """
 
-    try:
-        resp = agent.run(prompt)
+
+async def _enrich_chunks_async(chunks: list, openai_api_key: str = None) -> list:
+    """Enrich chunks concurrently; wall time is one RTT instead of N."""
+    Agent, OpenAIChat, _ = _phi()
+
+    async def one(chunk):
+        # A fresh agent per in-flight chunk: phi agents carry per-run
+        # state, so the cached instance is not shared across coroutines.
+        agent = Agent(
+            name="CMDB Enhancer",
+            model=OpenAIChat(id="gpt-5", api_key=openai_api_key),
+            instructions=_ENHANCER_INSTRUCTIONS,
+            markdown=True,
+        )
+        resp = await agent.arun(_enrich_prompt(chunk))
         content = resp.content if hasattr(resp, "content") else str(resp)
-        parsed = _extract_code_block(content, lang_hint="json")
-        
-        data = json.loads(parsed)
-        original_ids = {it.get("id") for it in cmdb_items}
-        result_ids = {it.get("id") for it in data}
-        missing = original_ids - result_ids
-        
+        return _loads(_extract_code_block(content, lang_hint="json"))
+
+    results = await asyncio.gather(*(one(c) for c in chunks))
+    return [it for sub in results for it in sub]
+
+
+def enrich_cmdb_with_ai(cmdb_items: list, openai_api_key: str = None) -> list:
+    """
+    Use AI to infer missing relations, group into layers, detect SPoF.
+    Results are memoized on disk by content hash, so identical CMDB data
+    only pays for the LLM call once; large CMDBs are enriched in
+    concurrent chunks.
+    """
+    key = hashlib.sha256(
+        json.dumps(cmdb_items, sort_keys=True, separators=(",", ":")).encode()
+    ).hexdigest()
+    cache_file = _ENRICH_CACHE_DIR / f"{key}.json"
+    if cache_file.exists():
+        try:
+            return _loads(cache_file.read_bytes())
+        except Exception:
+            pass
+
+    try:
+        if len(cmdb_items) > _ENRICH_CHUNK_SIZE:
+            chunks = [cmdb_items[i:i + _ENRICH_CHUNK_SIZE]
+                      for i in range(0, len(cmdb_items), _ENRICH_CHUNK_SIZE)]
+            data = asyncio.run(_enrich_chunks_async(chunks, openai_api_key))
+        else:
+            agent = _get_cached_agent("CMDB Enhancer", _ENHANCER_INSTRUCTIONS, openai_api_key)
+            resp = agent.run(_enrich_prompt(cmdb_items))
+            content = resp.content if hasattr(resp, "content") else str(resp)
+            data = _loads(_extract_code_block(content, lang_hint="json"))
+
+        by_id = {it.get("id"): it for it in cmdb_items}
+        missing = by_id.keys() - {it.get("id") for it in data}
         if missing:
-            for m in missing:
-                orig = next((it for it in cmdb_items if it.get("id") == m), None)
-                if orig:
-                    data.append(orig)
+            data.extend(by_id[m] for m in missing)
+        try:
+            _ENRICH_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            cache_file.write_text(_dumps(data), encoding="utf-8")
+        except OSError:
+            pass
         return data
     except Exception:
         return cmdb_items
@@ -204,43 +472,29 @@ def enrich_cmdb_with_ai(cmdb_items: list, openai_api_key: str = None) -> list:
 def _write_cmdb_to_temp_csv(cmdb_items: list) -> str:
     """Write CMDB items to temporary CSV"""
     tmp = tempfile.NamedTemporaryFile(
-        mode="w", suffix=".csv", delete=False, encoding="utf-8", newline="")
-    fieldnames = ["id", "name", "type", "attributes", "relations"]
-    writer = csv.DictWriter(tmp, fieldnames=fieldnames)
-    writer.writeheader()
-    
-    for it in cmdb_items:
-        writer.writerow({
-            "id": it.get("id"),
-            "name": it.get("name"),
-            "type": it.get("type"),
-            "attributes": json.dumps(it.get("attributes", {}), ensure_ascii=False),
-            "relations": json.dumps(it.get("relations", []), ensure_ascii=False),
-        })
+        mode="w", suffix=".csv", delete=False, encoding="utf-8", newline="",
+        buffering=1 << 20)
+    writer = csv.writer(tmp)
+    writer.writerow(["id", "name", "type", "attributes", "relations"])
+
+    encode = _dumps
+    writer.writerows(
+        (it.get("id"), it.get("name"), it.get("type"),
+         encode(it.get("attributes", {})), encode(it.get("relations", [])))
+        for it in cmdb_items
+    )
     tmp.flush()
     tmp.close()
     return tmp.name
 
 
-def _validate_and_fix_plantuml(plantuml_code: str) -> str:
+def _validate_and_fix_plantuml(plantuml_code: str, openai_api_key: str = None) -> str:
     """
     Validate and fix PlantUML syntax using AI.
     This is our SINGLE agent for fixing PlantUML code.
     """
     try:
-        agent = Agent(
-            name="PlantUML Validator",
-            model=OpenAIChat(id="gpt-5"),
-            instructions="""You are a PlantUML expert. Fix ANY syntax errors in PlantUML code.
-CRITICAL RULES:
-1. MUST start with @startuml and end with @enduml
-2. Use valid PlantUML components: package, rectangle, component, database, cloud, node, queue
-3. Use valid arrows: ->, -->, ->>, -->>
-4. Properly quote names with spaces: "Component Name"
-5. Fix all syntax errors while preserving the diagram intent
-Return ONLY the fixed PlantUML code in ```plantuml``` block.""",
-            markdown=True,
-        )
+        agent = _get_cached_agent("PlantUML Validator", _VALIDATOR_INSTRUCTIONS, openai_api_key)
 
         fix_prompt = f"""
         Fix this PlantUML code. It must be syntactically perfect and render without errors.
@@ -275,7 +529,7 @@ rectangle "System" as sys
 @enduml"""
 
 
-def process_cmdb_and_generate(cmdb_items: list = None, output_dir: str = ".") -> dict:
+def process_cmdb_and_generate(cmdb_items: list = None, output_dir: str = ".", openai_api_key: str = None) -> dict:
     """
     Main function: Process CMDB items and generate PlantUML diagram.
     FAST + DETAILED + ROBUST
@@ -289,18 +543,19 @@ def process_cmdb_and_generate(cmdb_items: list = None, output_dir: str = ".") ->
         tmp_csv_path = _write_cmdb_to_temp_csv(cmdb_items)
 
         # Initialize tools
+        Agent, OpenAIChat, CsvTools = _phi()
         csv_tool = CsvTools(
             csvs=[tmp_csv_path], read_csvs=True, list_csvs=True, read_column_names=True
         )
 
-        openai_key = os.getenv("OPENAI_API_KEY")
+        openai_key = openai_api_key or os.getenv("OPENAI_API_KEY")
         if not openai_key:
-            raise Exception("OPENAI_API_KEY environment variable is not set")
+            raise Exception("No OpenAI API key provided")
 
         # OPTIMIZED AGENT for fast, detailed diagrams
         agent = Agent(
             name="CMDB Architecture Generator",
-            model=OpenAIChat(id="gpt-5"),
+            model=OpenAIChat(id="gpt-5", api_key=openai_key),
             tools=[csv_tool],
             instructions="""Generate COMPREHENSIVE PlantUML component diagrams. Follow EXACT syntax:
 
@@ -333,7 +588,7 @@ Return ONLY ```plantuml``` code block.""",
         Create a DETAILED enterprise architecture diagram from {len(cmdb_items)} CMDB components.
         
         COMPONENTS TO INCLUDE:
-        {json.dumps([{'id': item['id'], 'name': item['name'], 'type': item['type'], 'relations': item.get('relations', [])} for item in cmdb_items], indent=2)}
+        {_dumps([{'id': item['id'], 'name': item['name'], 'type': item['type'], 'relations': item.get('relations', [])} for item in cmdb_items])}
         
         Create the MOST COMPREHENSIVE diagram showing ALL systems and relationships.
         Use proper PlantUML syntax that will render without errors.
@@ -350,6 +605,18 @@ Return ONLY ```plantuml``` code block.""",
         img_path = None
 
         while retry_count <= max_retries:
+            # Catch structural mistakes in Python before paying for a render
+            problem = _quick_validate(plantuml_code)
+            if problem and retry_count < max_retries:
+                print(f"✗ PlantUML structural issue (attempt {retry_count + 1}): {problem}")
+                local = _local_fix_plantuml(plantuml_code)
+                if local != plantuml_code and not _quick_validate(local):
+                    plantuml_code = local
+                else:
+                    plantuml_code = _validate_and_fix_plantuml(plantuml_code, openai_api_key=openai_key)
+                retry_count += 1
+                continue
+
             try:
                 # Try to render the current code
                 img_path = render_plantuml_from_text(
@@ -363,9 +630,14 @@ Return ONLY ```plantuml``` code block.""",
                 print(f"✗ PlantUML syntax error (attempt {retry_count + 1}): {str(syntax_error)[:200]}")
                 
                 if retry_count < max_retries:
-                    print("🔄 Fixing PlantUML syntax...")
-                    # Use our SINGLE agent to fix the code
-                    plantuml_code = _validate_and_fix_plantuml(plantuml_code)
+                    local = _local_fix_plantuml(plantuml_code)
+                    if retry_count == 0 and local != plantuml_code:
+                        print("🔧 Applying local PlantUML fixes...")
+                        plantuml_code = local
+                    else:
+                        print("🔄 Fixing PlantUML syntax...")
+                        # Use our SINGLE agent to fix the code
+                        plantuml_code = _validate_and_fix_plantuml(plantuml_code, openai_api_key=openai_key)
                     retry_count += 1
                 else:
                     print("❌ Max retries reached, using fallback diagram")
@@ -390,9 +662,17 @@ note right of [API Service]: Core business logic
                     )
                     break
 
-        # Extract components and relations
-        components = _extract_components_from_plantuml(plantuml_code)
-        relations = _extract_relations_from_plantuml(plantuml_code)
+        # Report from the canonical items instead of re-parsing the model's
+        # output; refine keeps regex extraction since it has no source items.
+        components = sorted({str(it.get("name") or it.get("id")) for it in cmdb_items})
+        relations = [
+            {
+                "source": str(it.get("name") or it.get("id")),
+                "target": r.get("target"),
+                "label": r.get("type", ""),
+            }
+            for it in cmdb_items for r in it.get("relations", [])
+        ]
 
         return {
             "success": True,
@@ -423,86 +703,37 @@ note right of [API Service]: Core business logic
 
 def _extract_components_from_plantuml(plantuml_code: str) -> list:
     """Extract components from PlantUML code"""
-    patterns = [
-        r'rectangle\s+"([^"]+)"', r'rectangle\s+(\w+)',
-        r'component\s+"([^"]+)"', r'component\s+(\w+)',
-        r'database\s+"([^"]+)"', r'database\s+(\w+)',
-        r'cloud\s+"([^"]+)"', r'cloud\s+(\w+)',
-        r'node\s+"([^"]+)"', r'node\s+(\w+)',
-        r'queue\s+"([^"]+)"', r'queue\s+(\w+)',
-        r'package\s+"([^"]+)"',
-        r'\[([^\]]+)\]',  # [Component]
-        r'\(([^)]+)\)',   # (Component)
-    ]
-    comps = []
-    for p in patterns:
-        matches = re.findall(p, plantuml_code, re.IGNORECASE)
-        comps.extend(matches)
-    
-    # Clean and deduplicate
-    cleaned = []
-    for comp in comps:
-        if isinstance(comp, tuple):
-            comp = comp[0]
+    comps = set()
+    for m in _COMPONENT_RE.finditer(plantuml_code):
+        comp = (m.group(1) or m.group(2) or m.group(3) or m.group(4) or "")
         comp = comp.strip().strip('"').strip()
-        if comp and comp not in cleaned and len(comp) > 1:
-            cleaned.append(comp)
-    
-    return sorted(cleaned)
+        if len(comp) > 1:
+            comps.add(comp)
+    return sorted(comps)
 
 
 def _extract_relations_from_plantuml(plantuml_code: str) -> list:
     """Extract relations from PlantUML arrows"""
     rels = []
-    
-    for line in plantuml_code.splitlines():
-        line = line.strip()
-        # Look for arrow patterns
-        if any(arrow in line for arrow in ["->", "-->", "->>", "-->>", "-left->", "-right->", "-up->", "-down->"]):
-            # Extract label if present
-            if ":" in line:
-                try:
-                    left_right, label = line.split(":", 1)
-                    label = label.strip()
-                except ValueError:
-                    left_right = line
-                    label = ""
-            else:
-                left_right = line
-                label = ""
-
-            # Extract source and target
-            parts = re.split(r'->+', left_right)
-            if len(parts) >= 2:
-                src = parts[0].strip().strip('"').strip('[]()')
-                dst = parts[1].strip().strip('"').strip('[]()')
-                
-                if src and dst:
-                    rels.append({
-                        "source": src,
-                        "target": dst, 
-                        "label": label
-                    })
-    
+    for m in _RELATION_RE.finditer(plantuml_code):
+        src = (m.group(1) or m.group(2) or m.group(3) or "").strip()
+        dst = (m.group(4) or m.group(5) or m.group(6) or "").strip()
+        if src and dst:
+            rels.append({
+                "source": src,
+                "target": dst,
+                "label": (m.group(7) or "").strip()
+            })
     return rels
 
 
-def refine_cmdb_plantuml_code(plantuml_code: str, message: str, output_dir: str):
+def refine_cmdb_plantuml_code(plantuml_code: str, message: str, output_dir: str, openai_api_key: str = None):
     """
     Refine existing PlantUML code based on user feedback.
     Uses the same validation/fixing agent.
     """
     try:
-        agent = Agent(
-            name="PlantUML Refiner",
-            model=OpenAIChat(id="gpt-5"),
-            instructions="""Refine PlantUML diagrams based on user requests.
-PRESERVE the original architecture and relationships.
-ENHANCE based on user feedback.
-ALWAYS return valid PlantUML syntax.
-Return ONLY ```plantuml``` code block.""",
-            markdown=True,
-        )
+        agent = _get_cached_agent("PlantUML Refiner", _REFINER_INSTRUCTIONS, openai_api_key)
         
         resp = agent.run(f"""
         Current diagram:
@@ -523,6 +754,16 @@ Return ONLY ```plantuml``` code block.""",
         img_path = None
 
         while retry_count <= max_retries:
+            problem = _quick_validate(updated_code)
+            if problem and retry_count < max_retries:
+                local = _local_fix_plantuml(updated_code)
+                if local != updated_code and not _quick_validate(local):
+                    updated_code = local
+                else:
+                    updated_code = _validate_and_fix_plantuml(updated_code, openai_api_key=openai_api_key)
+                retry_count += 1
+                continue
+
             try:
                 img_path = render_plantuml_from_text(
                     updated_code, 
@@ -532,7 +773,11 @@ Return ONLY ```plantuml``` code block.""",
                 break
             except PlantUMLSyntaxError:
                 if retry_count < max_retries:
-                    updated_code = _validate_and_fix_plantuml(updated_code)
+                    local = _local_fix_plantuml(updated_code)
+                    if retry_count == 0 and local != updated_code:
+                        updated_code = local
+                    else:
+                        updated_code = _validate_and_fix_plantuml(updated_code, openai_api_key=openai_api_key)
                     retry_count += 1
                 else:
                     raise
@@ -1,105 +1,390 @@
 # app/services/plantuml_service.py
+import hashlib
+import logging
+import os
+import re
+import select
+import shutil
 import subprocess
+import tempfile
+import threading
 from pathlib import Path
+from queue import Queue
+
+logger = logging.getLogger(__name__)
 
 PLANTUML_JAR = Path(__file__).resolve().parents[1] / "plantuml.jar"  # backend/plantuml.jar
 
+# Long-lived -pipe JVM workers; set PLANTUML_PIPE_WORKERS=0 to fall back to
+# one-shot java -jar spawns per render.
+PIPE_POOL_SIZE = int(os.getenv("PLANTUML_PIPE_WORKERS", "2"))
+_PIPE_DELIMITER = "__PLANTUML_PIPE_DONE__"
+
+# Content-addressed image cache shared by every caller (and, on-disk, by
+# every worker process): identical PlantUML source renders once per format.
+_RENDER_CACHE_DIR = Path(tempfile.gettempdir()) / "plantuml_cache"
+
+# Output formats we know how to ask PlantUML for. SVG skips the Java2D
+# raster pipeline entirely, so it is materially cheaper per diagram.
+_FORMAT_FLAGS = {"png": "-tpng", "svg": "-tsvg"}
+
+_PNG_MAGIC = b"\x89PNG\r\n\x1a\n"
+
+# PlantUML reports syntax errors with an "ERROR" line on stderr; matching
+# that anchored token avoids misfiring on benign JVM/Graphviz warnings
+# that merely contain the word "error".
+_STDERR_ERROR_RE = re.compile(rb"^\s*ERROR\b", re.MULTILINE)
+
+
+def _cache_key(puml_text: str) -> str:
+    return hashlib.sha256(puml_text.encode("utf-8")).hexdigest()
+
+
+def _link_or_copy(src: Path, dst: Path):
+    """Hardlink src to dst, falling back to a copy when the link fails
+    (cross-device cache dir, existing dst on a quirky filesystem, ...)."""
+    try:
+        dst.unlink(missing_ok=True)
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def _cache_store(key: str, img_path: Path, fmt: str = "png"):
+    """Atomically publish a rendered image into the cache; best-effort."""
+    try:
+        _RENDER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=_RENDER_CACHE_DIR, delete=False) as tmp:
+            shutil.copyfileobj(open(img_path, "rb"), tmp)
+        os.replace(tmp.name, _RENDER_CACHE_DIR / f"{key}.{fmt}")
+    except OSError:
+        pass
+
+
+_java_ok = None
+_java_lock = threading.Lock()
+
+
+def _check_java_once() -> bool:
+    """Probe `java -version` once per process instead of per render."""
+    global _java_ok
+    if _java_ok is None:
+        with _java_lock:
+            if _java_ok is None:
+                try:
+                    subprocess.run(["java", "-version"], check=True, capture_output=True)
+                    _java_ok = True
+                except (subprocess.CalledProcessError, FileNotFoundError, OSError):
+                    _java_ok = False
+    return _java_ok
+
 
 class PlantUMLSyntaxError(Exception):
     """Custom exception for PlantUML syntax errors"""
     pass
 
-def render_plantuml_from_text(puml_text: str, output_dir: str, filename_base: str = "plantuml"):
+
+class _PipeWorker:
+    """One persistent `java -jar plantuml.jar -pipe` process."""
+
+    def __init__(self, fmt: str = "png"):
+        self.fmt = fmt
+        self.proc = subprocess.Popen(
+            [
+                "java", "-jar", str(PLANTUML_JAR.resolve()),
+                "-pipe", "-pipedelimitor", _PIPE_DELIMITER,
+                _FORMAT_FLAGS[fmt], "-charset", "UTF-8",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        # stderr is only polled after each render; keep it non-blocking
+        os.set_blocking(self.proc.stderr.fileno(), False)
+        # stdout bytes left over after a render (nothing should follow the
+        # delimiter's newline, but never let them prefix the next image)
+        self._buf = bytearray()
+
+    def alive(self) -> bool:
+        return self.proc.poll() is None
+
+    def kill(self):
+        try:
+            self.proc.kill()
+        except OSError:
+            pass
+
+    # How long stderr must stay silent before we call a render clean. The
+    # delimiter on stdout carries no ordering guarantee relative to the
+    # JVM's stderr flush, so a single non-blocking read can miss the
+    # diagnostics of an error render entirely.
+    _STDERR_QUIET_WINDOW = 0.05
+
+    def _drain_stderr(self) -> bytes:
+        """Read stderr until a quiet window passes with no new data."""
+        chunks = []
+        fd = self.proc.stderr.fileno()
+        while True:
+            ready, _, _ = select.select([fd], [], [], self._STDERR_QUIET_WINDOW)
+            if not ready:
+                break
+            try:
+                data = os.read(fd, 65536)
+            except (BlockingIOError, OSError):
+                break
+            if not data:
+                break
+            chunks.append(data)
+        return b"".join(chunks)
+
+    def render(self, puml_text: str):
+        """Returns (image_bytes, stderr_bytes); stderr is empty on a clean render."""
+        payload = puml_text if puml_text.endswith("\n") else puml_text + "\n"
+        self.proc.stdin.write(payload.encode("utf-8"))
+        self.proc.stdin.flush()
+
+        delim = _PIPE_DELIMITER.encode("utf-8")
+        buf = self._buf
+        while True:
+            idx = buf.find(delim)
+            if idx != -1:
+                break
+            chunk = self.proc.stdout.read1(65536)
+            if not chunk:
+                raise RuntimeError("PlantUML pipe worker closed its stdout")
+            buf += chunk
+        img_bytes = bytes(buf[:idx])
+        # Consume the delimiter and its trailing newline so the next render
+        # starts at its own first byte.
+        end = idx + len(delim)
+        if buf[end:end + 1] == b"\n":
+            end += 1
+        del buf[:end]
+
+        err = self._drain_stderr()
+        if _STDERR_ERROR_RE.search(err):
+            raise PlantUMLSyntaxError(
+                f"Invalid PlantUML syntax. {err.decode('utf-8', errors='replace')[:500]}"
+            )
+        # A desynced stream would hand back garbage; verify the payload
+        # actually looks like the requested format before trusting it.
+        if self.fmt == "png" and not img_bytes.startswith(_PNG_MAGIC):
+            raise RuntimeError("PlantUML pipe worker returned non-PNG output")
+        if self.fmt == "svg" and img_bytes.lstrip()[:4] not in (b"<?xm", b"<svg"):
+            raise RuntimeError("PlantUML pipe worker returned non-SVG output")
+        return img_bytes, err
+
+
+class _PlantUMLPipePool:
     """
-    Write a .puml and call local plantuml.jar to render a PNG.
-    Returns the path to the produced PNG.
+    Bounded pool of persistent PlantUML pipe workers, so renders cost one
+    diagram instead of one JVM boot + one diagram.
     """
+
+    def __init__(self, size: int, fmt: str = "png"):
+        self._size = size
+        self._fmt = fmt
+        self._idle = Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _spawn(self) -> _PipeWorker:
+        """Create a worker against a slot already counted in _created,
+        releasing the slot if the JVM fails to start."""
+        try:
+            return _PipeWorker(self._fmt)
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def _acquire(self) -> _PipeWorker:
+        spawn = False
+        with self._lock:
+            if self._idle.empty() and self._created < self._size:
+                self._created += 1
+                spawn = True
+        if spawn:
+            return self._spawn()
+        return self._idle.get()
+
+    def _discard(self, worker: _PipeWorker):
+        worker.kill()
+        with self._lock:
+            self._created -= 1
+
+    def render(self, puml_text: str):
+        worker = self._acquire()
+        if not worker.alive():
+            self._discard(worker)
+            with self._lock:
+                self._created += 1
+            worker = self._spawn()
+        try:
+            result = worker.render(puml_text)
+        except PlantUMLSyntaxError:
+            # worker is still in sync after an error image; keep it
+            self._idle.put(worker)
+            raise
+        except Exception:
+            self._discard(worker)
+            raise
+        self._idle.put(worker)
+        return result
+
+
+# Pools are per output format (each worker's -t flag is fixed at spawn);
+# the PNG pool is the common case and others are created on first use.
+_pipe_pools = {}
+_pipe_pools_lock = threading.Lock()
+
+
+def _get_pipe_pool(fmt: str):
+    if PIPE_POOL_SIZE <= 0:
+        return None
+    pool = _pipe_pools.get(fmt)
+    if pool is None:
+        with _pipe_pools_lock:
+            pool = _pipe_pools.setdefault(fmt, _PlantUMLPipePool(PIPE_POOL_SIZE, fmt))
+    return pool
+
+
+def render_plantuml_from_text(puml_text: str, output_dir: str, filename_base: str = "plantuml",
+                              format: str = "png"):
+    """
+    Write a .puml and call local plantuml.jar to render an image.
+    `format` is "png" (default) or "svg"; SVG skips the raster pipeline in
+    the JVM and produces smaller files. Returns the path to the image.
+    """
+    if format not in _FORMAT_FLAGS:
+        raise ValueError(f"Unsupported format: {format!r} (expected one of {sorted(_FORMAT_FLAGS)})")
+    # Reject obviously broken input (empty fixer output, missing envelope)
+    # before paying for a JVM round trip; the caller's fix/retry logic
+    # handles PlantUMLSyntaxError either way.
+    if not puml_text or "@startuml" not in puml_text or "@enduml" not in puml_text:
+        raise PlantUMLSyntaxError(
+            "Invalid PlantUML syntax. Source must contain @startuml and @enduml."
+        )
     try:
-        print("=== RENDER_PLANTUML_START ===")
-        print(f"Timestamp: {__import__('datetime').datetime.now()}")
-        print(f"Output directory: {output_dir}")
-        print(f"Filename base: {filename_base}")
-        print(f"PlantUML text length: {len(puml_text)}")
-        
+        logger.info("=== RENDER_PLANTUML_START ===")
+        logger.debug("Output directory: %s", output_dir)
+        logger.debug("Filename base: %s", filename_base)
+        logger.debug("PlantUML text length: %s", len(puml_text))
         outdir = Path(output_dir)
-        print(f"Creating output directory: {outdir}")
+        logger.debug("Creating output directory: %s", outdir)
         outdir.mkdir(parents=True, exist_ok=True)
-        print(f"✓ Output directory created/verified")
-        
+        logger.debug("✓ Output directory created/verified")
         puml_file = outdir / f"{filename_base}.puml"
-        png_file = outdir / f"{filename_base}.png"
-        print(f"PlantUML file path: {puml_file}")
-        print(f"Expected PNG path: {png_file}")
+        img_file = outdir / f"{filename_base}.{format}"
+        logger.debug("PlantUML file path: %s", puml_file)
+        logger.debug("Expected image path: %s", img_file)
+        cache_key = _cache_key(puml_text)
+        cached = _RENDER_CACHE_DIR / f"{cache_key}.{format}"
+        if cached.exists():
+            # One link syscall instead of an fread/fwrite loop over the image
+            _link_or_copy(cached, img_file)
+            logger.info("=== RENDER_PLANTUML_SUCCESS (cache hit) ===")
+            return str(img_file)
 
-        print("Writing PlantUML file...")
-        puml_file.write_text(puml_text, encoding="utf-8")
-        print(f"✓ PlantUML file written successfully")
-
-        print(f"Checking for PlantUML jar at: {PLANTUML_JAR}")
+        logger.debug("Checking for PlantUML jar at: %s", PLANTUML_JAR)
         if not PLANTUML_JAR.exists():
-            print(f"✗ ERROR: plantuml.jar not found at {PLANTUML_JAR}")
+            logger.error("✗ ERROR: plantuml.jar not found at %s", PLANTUML_JAR)
             raise FileNotFoundError(f"plantuml.jar not found at {PLANTUML_JAR}")
-        print(f"✓ PlantUML jar found")
-
-        # Check if Java is available
-        print("Checking Java availability...")
-        try:
-            result = subprocess.run(["java", "-version"], check=True, capture_output=True, text=True)
-            print(f"✓ Java is available")
-            print(f"Java version output: {result.stderr[:100]}...")
-        except (subprocess.CalledProcessError, FileNotFoundError) as e:
-            print(f"✗ ERROR: Java is not installed or not in PATH: {str(e)}")
+        logger.debug("✓ PlantUML jar found")
+        # Fast path: reuse a persistent -pipe JVM worker instead of booting a
+        # fresh JVM for this render.
+        pipe_pool = _get_pipe_pool(format)
+        if pipe_pool is not None:
+            try:
+                img_bytes, pipe_err = pipe_pool.render(puml_text)
+                img_file.write_bytes(img_bytes)
+                if pipe_err:
+                    # stderr chatter may mean an error image that the
+                    # (non-blocking) error check raced past; don't let it
+                    # into the content-addressed cache.
+                    logger.debug("Pipe worker stderr non-empty, not caching: %.200s", pipe_err)
+                else:
+                    _cache_store(cache_key, img_file, format)
+                logger.info("=== RENDER_PLANTUML_SUCCESS (pipe pool) ===")
+                return str(img_file)
+            except PlantUMLSyntaxError:
+                raise
+            except Exception as pipe_err:
+                logger.debug("Pipe pool render failed (%s); falling back to one-shot JVM", pipe_err)
+        # Only the one-shot fallback needs the source on disk; the pipe
+        # workers take it over stdin.
+        logger.debug("Writing PlantUML file...")
+        puml_file.write_bytes(puml_text.encode("utf-8"))
+        logger.debug("✓ PlantUML file written successfully")
+        # Check if Java is available (memoized; costs a JVM spawn once)
+        if not _check_java_once():
+            logger.error("✗ ERROR: Java is not installed or not in PATH")
             raise Exception("Java is not installed or not in PATH")
 
-        # call PlantUML to generate PNG
-        cmd = ["java", "-jar", str(PLANTUML_JAR.resolve()), "-tpng", str(puml_file), "-charset", "UTF-8"]
-        print(f"Running PlantUML command: {' '.join(cmd)}")
-        print(f"Working directory: {outdir}")
-        
-        result = subprocess.run(cmd, cwd=str(outdir), capture_output=True, text=True)
-        
+        # call PlantUML to generate the image
+        cmd = ["java", "-jar", str(PLANTUML_JAR.resolve()), _FORMAT_FLAGS[format], str(puml_file), "-charset", "UTF-8"]
+        logger.debug("Running PlantUML command: %s", ' '.join(cmd))
+        # Stdout is unused, so discard it at the fd level; stderr stays as
+        # bytes and is only decoded on the failure path. All paths in cmd are
+        # absolute, so no cwd is needed.
+        result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
         # Check for errors (exit code 200 means PlantUML syntax error)
         if result.returncode != 0:
+            stderr_text = (result.stderr or b"").decode("utf-8", errors="replace")
             error_msg = f"PlantUML rendering failed with exit code {result.returncode}\n"
-            error_msg += f"STDOUT: {result.stdout}\n"
-            error_msg += f"STDERR: {result.stderr}\n"
-            print(f"✗ {error_msg}")
-            
+            error_msg += f"STDERR: {stderr_text}\n"
+            logger.error("✗ %s", error_msg)
             if result.returncode == 200:
                 # Syntax error in PlantUML code
                 raise PlantUMLSyntaxError(f"Invalid PlantUML syntax. {error_msg}")
             else:
                 raise Exception(error_msg)
-        
-        print(f"✓ PlantUML command executed successfully")
-        print(f"PlantUML stdout: {result.stdout}")
+
+        logger.debug("✓ PlantUML command executed successfully")
         if result.stderr:
-            print(f"PlantUML stderr: {result.stderr}")
-
-        # PlantUML usually writes png alongside the puml file
-        print(f"Checking if PNG file exists at: {png_file}")
-        if not png_file.exists():
-            print("PNG file not found at expected location, searching for alternatives...")
-            # PlantUML may name output differently; search for *.png in outdir matching filename_base
-            matches = list(outdir.glob(f"{filename_base}*.png"))
+            logger.debug("PlantUML stderr: %s", result.stderr.decode("utf-8", errors="replace"))
+        # PlantUML usually writes the image alongside the puml file
+        logger.debug("Checking if image file exists at: %s", img_file)
+        if not img_file.exists():
+            logger.debug("Image not found at expected location, searching for alternatives...")
+            # PlantUML may name output differently; search outdir for the format matching filename_base
+            matches = list(outdir.glob(f"{filename_base}*.{format}"))
             if matches:
-                print(f"✓ Found PNG file: {matches[0]}")
-                print("=== RENDER_PLANTUML_SUCCESS ===")
+                logger.debug("✓ Found image file: %s", matches[0])
+                _cache_store(cache_key, matches[0], format)
+                logger.info("=== RENDER_PLANTUML_SUCCESS ===")
                 return str(matches[0])
             else:
-                print(f"✗ ERROR: No PNG files found matching pattern {filename_base}*.png")
-                print(f"Files in directory: {list(outdir.glob('*'))}")
-                raise FileNotFoundError("PlantUML did not produce a PNG.")
+                logger.error("✗ ERROR: No files found matching pattern %s*.%s", filename_base, format)
+                logger.debug("Files in directory: %s", list(outdir.glob('*')))
+                raise FileNotFoundError(f"PlantUML did not produce a {format.upper()}.")
         else:
-            print(f"✓ PNG file found at expected location: {png_file}")
-        
-        print("=== RENDER_PLANTUML_SUCCESS ===")
-        return str(png_file)
-    except Exception as e:
-        print(f"=== RENDER_PLANTUML_ERROR ===")
-        print(f"Error: {str(e)}")
-        print(f"Error type: {type(e).__name__}")
-        import traceback
-        traceback.print_exc()
-        print("=== RENDER_PLANTUML_ERROR_END ===")
-        raise
\ No newline at end of file
+            logger.debug("✓ Image file found at expected location: %s", img_file)
+        _cache_store(cache_key, img_file, format)
+        logger.info("=== RENDER_PLANTUML_SUCCESS ===")
+        return str(img_file)
+    except Exception:
+        logger.exception("=== RENDER_PLANTUML_ERROR ===")
+        raise
+
+def render_many(puml_texts, output_dir: str, filename_bases=None, max_workers: int = None,
+                format: str = "png"):
+    """
+    Render several diagrams concurrently. Threads are enough here: each
+    render blocks on a pipe worker's JVM (or a spawned one), so wall time is
+    bounded by the slowest diagram per worker instead of the serial sum.
+    Returns PNG paths in input order.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    texts = list(puml_texts)
+    if filename_bases is None:
+        filename_bases = [f"plantuml_{i}" for i in range(len(texts))]
+    workers = max_workers or max(PIPE_POOL_SIZE, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        futures = [
+            ex.submit(render_plantuml_from_text, text, output_dir, base, format)
+            for text, base in zip(texts, filename_bases)
+        ]
+        return [f.result() for f in futures]
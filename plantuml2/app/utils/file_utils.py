@@ -0,0 +1,24 @@
+# app/utils/file_utils.py
+from pathlib import Path
+
+
+def evict_lru(cache_dir: Path, max_entries: int = 128) -> None:
+    """
+    Bound an on-disk cache directory: keep at most max_entries files,
+    evicting the least-recently-accessed ones first. Sibling workers evict
+    the same directory concurrently, so files may vanish at any point.
+    """
+    entries = []
+    for p in cache_dir.glob("*.pkl"):
+        try:
+            entries.append((p.stat().st_atime, p))
+        except OSError:
+            continue  # already evicted by another worker
+    if len(entries) <= max_entries:
+        return
+    entries.sort()
+    for _, stale in entries[: len(entries) - max_entries]:
+        try:
+            stale.unlink()
+        except OSError:
+            pass
@@ -0,0 +1,64 @@
+# app/utils/static_cache.py
+import os
+import re
+from pathlib import Path
+
+from fastapi.staticfiles import StaticFiles
+from starlette.exceptions import HTTPException
+from starlette.responses import Response
+
+# Vite emits content-hashed asset names (e.g. index-BfQ8x1Zk.js); generated
+# diagram PNGs keep stable names and must stay revalidatable.
+_HASHED_NAME = re.compile(r"[-.][0-9a-zA-Z_-]{8,}\.(?:js|css|png|svg|woff2?)$")
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles that sets Cache-Control: content-hash-named files are served
+    as immutable for a year, everything else gets a short max-age and is
+    revalidated through the ETag/Last-Modified headers StaticFiles already
+    emits.
+    """
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200):
+        response = super().file_response(full_path, stat_result, scope, status_code)
+        name = os.path.basename(str(full_path))
+        if _HASHED_NAME.search(name):
+            response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+        else:
+            response.headers["Cache-Control"] = "public, max-age=60"
+        return response
+
+
+class SPAStaticFiles(CachedStaticFiles):
+    """
+    Static mount for the built React app: unknown paths fall back to
+    index.html so client-side routes resolve without going through a Python
+    catch-all handler.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._index_bytes = None
+
+    async def get_response(self, path: str, scope):
+        # StaticFiles raises HTTPException(404) for unknown paths (it only
+        # returns a 404 response when the directory ships a 404.html, which
+        # a Vite build never does), so the fallback must catch, not inspect.
+        try:
+            return await super().get_response(path, scope)
+        except HTTPException as exc:
+            if exc.status_code != 404:
+                raise
+            # Serve the cached index bytes instead of re-stating and
+            # re-reading index.html on every SPA deep link.
+            if self._index_bytes is None:
+                try:
+                    self._index_bytes = (Path(self.directory) / "index.html").read_bytes()
+                except OSError:
+                    raise exc
+            return Response(
+                self._index_bytes,
+                media_type="text/html",
+                headers={"Cache-Control": "no-cache"},
+            )
@@ -1,16 +1,28 @@
 #!/usr/bin/env python3
 """
-Script to run the FastAPI server on port 2004
+Script to run the FastAPI server on port 2004.
+
+Set RELOAD=1 for the dev auto-reload loop (single worker, file watcher).
+The default is the production path: one worker per CPU with httptools and
+uvloop where available (loop="auto"; uvloop is skipped on Windows). The
+render cache is on disk, so workers share it for free.
 """
+import os
+
 import uvicorn
-from app.main import app
+
+RELOAD = os.getenv("RELOAD", "0") == "1"
 
 if __name__ == "__main__":
     uvicorn.run(
         "app.main:app",
         host="0.0.0.0",
         port=2004,
-        reload=True,
+        reload=RELOAD,
+        workers=1 if RELOAD else (os.cpu_count() or 1),
+        loop="auto",
+        http="httptools",
+        log_level="info",
         timeout_keep_alive=300,
         timeout_graceful_shutdown=30
     )
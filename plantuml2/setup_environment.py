@@ -3,6 +3,7 @@
 Environment setup script for PlantUML server
 This script checks for required dependencies and environment variables
 """
+import importlib.util
 import os
 import subprocess
 import sys
@@ -51,10 +52,11 @@ def check_python_dependencies():
     
     missing_packages = []
     for package in required_packages:
-        try:
-            __import__(package.replace("-", "_"))
+        # find_spec only consults the import machinery; it never executes the
+        # package, so the check stays fast and light even for heavy modules.
+        if importlib.util.find_spec(package.replace("-", "_")) is not None:
             print(f"✓ {package} is installed")
-        except ImportError:
+        else:
             print(f"✗ {package} is missing")
             missing_packages.append(package)
     
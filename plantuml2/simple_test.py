@@ -1,8 +1,15 @@
 import requests
 import json
+from requests.adapters import HTTPAdapter, Retry
 
 BASE_URL = "http://127.0.0.1:8000"
 
+# Shared session: keep-alive connection plus a small retry budget for
+# transient connection errors.
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.1)))
+SESSION.mount("https://", HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.1)))
+
 def test_generate_diagram():
     # Sample test cases
     test_cases = [
@@ -35,7 +42,7 @@ def test_generate_diagram():
     print(f"Test cases count: {len(test_cases)}")
     
     try:
-        resp = requests.post(url, json=payload, headers=headers)
+        resp = SESSION.post(url, json=payload, headers=headers)
         print(f"Status: {resp.status_code}")
         
         if resp.status_code == 200:
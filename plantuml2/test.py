@@ -1,16 +1,23 @@
 import requests
 import json
+from requests.adapters import HTTPAdapter, Retry
 from tabulate import tabulate
 from InquirerPy import inquirer
 
 BASE_URL = "http://127.0.0.1:8000"   # FastAPI server
 FILE_PATH = "sample.xlsx"            # your input file
 
+# One session for the whole run: reuses the TCP connection across calls and
+# retries transient connection errors instead of dying on the first hiccup.
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.1)))
+SESSION.mount("https://", HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.1)))
+
 
 def test_upload_csv():
     url = f"{BASE_URL}/upload-csv/"
-    files = {"file": open(FILE_PATH, "rb")}
-    resp = requests.post(url, files=files)
+    with open(FILE_PATH, "rb") as f:
+        resp = SESSION.post(url, files={"file": f})
     print("\n--- /upload-csv/ ---")
     print("Status:", resp.status_code)
     data = resp.json()
@@ -63,7 +70,7 @@ def edit_test_cases(test_cases):
 def test_generate_diagram(test_cases):
     url = f"{BASE_URL}/generate-diagram/"
     payload = {"test_cases": test_cases}
-    resp = requests.post(url, json=payload)
+    resp = SESSION.post(url, json=payload)
     print("\n--- /generate-diagram/ ---")
     print("Status:", resp.status_code)
     data = resp.json()
@@ -83,7 +90,7 @@ def test_chat_plantuml(plantuml_code):
         "plantuml_code": plantuml_code,
         "message": "Add a database actor and show it saving user data"
     }
-    resp = requests.post(url, json=payload)
+    resp = SESSION.post(url, json=payload)
     print("\n--- /chat-plantuml/ ---")
     print("Status:", resp.status_code)
     data = resp.json()
@@ -26,6 +26,12 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(mes
 logger = logging.getLogger("test.py")
 
 def open_image(path: Path):
+    # Headless runs (CI, piped output, no X display) have no browser to open;
+    # spawning xdg-open there just burns a subprocess and can hang. Only try
+    # when we're interactive and a GUI is plausible.
+    if not (sys.stdout.isatty() and (os.environ.get("DISPLAY") or sys.platform in ("darwin", "win32"))):
+        logger.info(f"Image saved at: {path}")
+        return
     try:
         logger.info(f"Opening image: {path}")
         webbrowser.open(path.as_uri())
@@ -86,9 +92,17 @@ def run_server_mode(csv_path: Path, output_dir: Path, server_url="http://localho
     logger.info("Attempting server mode (uploading to FastAPI)...")
     try:
         import requests
+        from requests.adapters import HTTPAdapter, Retry
     except Exception:
         raise RuntimeError("requests library required for server mode. Install it with: pip install requests")
 
+    # One session for upload + generate + download: reuses the connection and
+    # retries transient connection errors.
+    session = requests.Session()
+    adapter = HTTPAdapter(max_retries=Retry(total=3, backoff_factor=0.1))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
     upload_url = f"{server_url.rstrip('/')}/upload-cmdb/"
     generate_url = f"{server_url.rstrip('/')}/generate-cmdb-diagram/"
 
@@ -103,7 +117,7 @@ def run_server_mode(csv_path: Path, output_dir: Path, server_url="http://localho
     logger.info(f"Uploading CMDB file to {upload_url} ...")
     with open(csv_path, "rb") as f:
         files = {"file": (csv_path.name, f, "text/csv")}
-        resp = requests.post(upload_url, headers=headers, files=files, timeout=120)
+        resp = session.post(upload_url, headers=headers, files=files, timeout=120)
     if resp.status_code != 200:
         raise RuntimeError(f"Upload failed ({resp.status_code}): {resp.text}")
     data = resp.json()
@@ -115,7 +129,7 @@ def run_server_mode(csv_path: Path, output_dir: Path, server_url="http://localho
 
     # Call generate endpoint with the parsed/edited cmdb_items
     payload = {"cmdb_items": cmdb_items}
-    resp2 = requests.post(generate_url, headers={**headers, "Content-Type": "application/json"}, json=payload, timeout=180)
+    resp2 = session.post(generate_url, headers={**headers, "Content-Type": "application/json"}, json=payload, timeout=180)
     if resp2.status_code != 200:
         raise RuntimeError(f"Generate failed ({resp2.status_code}): {resp2.text}")
     gdata = resp2.json()
@@ -129,7 +143,7 @@ def run_server_mode(csv_path: Path, output_dir: Path, server_url="http://localho
     # Download the image to output_dir
     img_url = server_url.rstrip("/") + img_rel if img_rel.startswith("/") else img_rel
     logger.info(f"Downloading generated image from {img_url} ...")
-    rimg = requests.get(img_url, timeout=60)
+    rimg = session.get(img_url, timeout=60)
     output_dir.mkdir(parents=True, exist_ok=True)
     img_name = Path(img_rel).name
     img_path = output_dir / img_name